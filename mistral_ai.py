@@ -1,17 +1,23 @@
 from dotenv import load_dotenv
 import os
+import time
+import random
 import asyncio
 import logging
 import aiosqlite
 import aiohttp
-import json
+import orjson
 import hashlib
+import uvloop
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from functools import wraps
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardButton
 from aiogram.methods import DeleteWebhook
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiolimiter import AsyncLimiter
 
 
 # Загрузка переменных окружения из файла .env
@@ -29,6 +35,7 @@ TOKEN = os.getenv('TELEGRAM_TOKEN')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 CRYPTOCLOUD_API_KEY = os.getenv('CRYPTOCLOUD_API_KEY')
 CRYPTOCLOUD_SHOP_ID = os.getenv('CRYPTOCLOUD_SHOP_ID')
+ADMIN_ID = int(os.getenv('ADMIN_ID', 0))  # для /stats; 0 - команда отключена
 CRYPTOCLOUD_PAYMENT_LINK = f"https://pay.cryptocloud.plus/pos/{CRYPTOCLOUD_SHOP_ID}"
 
 # Инициализация бота
@@ -42,29 +49,152 @@ SUBSCRIPTION_PRICE_3 = 3
 MISTRAL_MODEL = "mistral-medium-latest"
 MAX_FREE_REQUESTS_PER_DAY = 10  # Лимит бесплатных запросов
 
+# Постоянные заголовки и каркас payload собираются один раз при импорте,
+# чтобы не пересоздавать одни и те же словари на каждый запрос
+MISTRAL_HEADERS = {
+    "Authorization": f"Bearer {MISTRAL_API_KEY}",
+    "Content-Type": "application/json",
+    "Accept": "application/json"
+}
+
+CRYPTOCLOUD_HEADERS = {
+    "Authorization": f"Token {CRYPTOCLOUD_API_KEY}",
+    "Content-Type": "application/json"
+}
+
+MISTRAL_PAYLOAD_BASE = {
+    "model": MISTRAL_MODEL,
+    "temperature": 0.7,
+    "max_tokens": 2000
+}
+
+# Генерация длинного ответа спокойно идёт дольше 30 секунд, поэтому
+# для Mistral общий лимит снят: ограничиваем только установку
+# соединения и паузу между чанками. Сессионный total=30 остаётся
+# для коротких вызовов CryptoCloud
+MISTRAL_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=5, sock_read=25)
+
+# Общая HTTP-сессия (создаётся в main), чтобы переиспользовать
+# соединения через keep-alive вместо нового TCP+TLS на каждый запрос
+SESSION: aiohttp.ClientSession | None = None
+
+# Одно долгоживущее соединение с бд (создаётся в main): aiosqlite
+# держит рабочий поток, открывать/закрывать его на каждый запрос дорого
+DB: aiosqlite.Connection | None = None
+
+# Защищает многошаговые последовательности SELECT+UPDATE в check_access
+DB_LOCK = asyncio.Lock()
+
+# Кэш счетчиков в памяти: user_id -> [дата, запросов сегодня, subscribed_until].
+# Бд трогаем только при промахе и при периодическом сбросе на диск
+COUNTERS: dict[int, list] = {}
+
+# Пользователи, чьи счетчики изменились с последнего сброса в бд
+DIRTY_USERS: set[int] = set()
+
+# Интервал записи изменённых счетчиков в бд, в секундах
+FLUSH_INTERVAL = 30
+
+# LRU-кэш ответов Mistral: blake2b(промпт) -> (момент записи, текст).
+# Повторные одинаковые промпты ("привет" и т.п.) не ходят в API вовсе
+RESPONSE_CACHE: OrderedDict[bytes, tuple[float, str]] = OrderedDict()
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 3600  # секунд жизни записи
+
+# Статистика по горячим функциям: имя -> (вызовов, суммарных секунд).
+# Заполняется декоратором timed, выводится админской командой /stats
+PROF: dict[str, tuple[int, float]] = {}
+
+# Клиентский токен-бакет чуть ниже лимитов Mistral API: лучше притормозить
+# у себя, чем сжечь квоту на запросах, которые вернутся с 429
+MISTRAL_LIMITER = AsyncLimiter(max_rate=5, time_period=1)
+MISTRAL_MAX_RETRIES = 3
+MISTRAL_BACKOFF_BASE = 1.0  # секунд
+MISTRAL_BACKOFF_CAP = 30.0
+
+# Один запрос к Mistral на пользователя одновременно: шквал сообщений
+# от одного юзера не съедает квоту API пачкой параллельных вызовов
+USER_LOCKS: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# Клавиатура покупки подписки одинакова для всех пользователей -
+# собираем её один раз, а не на каждый /start
+_buy_builder = InlineKeyboardBuilder()
+_buy_builder.row(InlineKeyboardButton(
+    text="💳 Купить подписку (3 USD)",
+    callback_data="buy_subscription")
+)
+BUY_MARKUP = _buy_builder.as_markup()
+
+# Шаблоны постоянных текстов собираются один раз при импорте;
+# на горячем пути остаётся только подстановка переменных полей
+START_TEXT = (
+    "🤖 Привет! Я бот с Mistral AI.\n\n"
+    "🎁 У вас осталось {remaining} бесплатных запросов сегодня\n"
+    "🔓 Для неограниченного доступа оформите подписку."
+)
+
+LIMIT_EXCEEDED_TEXT = (
+    "🚫 Лимит бесплатных запросов исчерпан (10 в день).\n"
+    "Оформите подписку для неограниченного доступа.\n"
+    "Новые запросы будут доступны через {time_until_midnight}."
+)
+
+
+def timed(name: str):
+    """
+    Декоратор: накапливает в PROF число вызовов и суммарное время корутины.
 
-async def init_db():
-    """Функция для создания бд."""
-    async with aiosqlite.connect("users.db") as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                subscribed_until TEXT,
-                last_request_date TEXT,
-                requests_today INTEGER DEFAULT 0,
-                invoice_id TEXT
-            )
-        """)
-        await db.commit()
+    Стоимость - два вызова perf_counter на границах, зато видно,
+    какой шаг обработки сообщения доминирует в задержке.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                count, total = PROF.get(name, (0, 0.0))
+                PROF[name] = (count + 1, total + time.perf_counter() - started)
+        return wrapper
+    return decorator
 
 
-async def reset_daily_limits():
-    """Сбрасывает дневные лимиты для всех пользователей."""
-    async with aiosqlite.connect("users.db") as db:
-        await db.execute(
-            "UPDATE users SET requests_today = 0"
+async def init_db():
+    """Функция для создания бд."""
+    db = DB
+    # WAL: читатели не блокируют писателей, запись идёт
+    # последовательно в журнал вместо полной перезаписи
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA mmap_size=268435456")
+    # Ждём до 5 секунд вместо мгновенного "database is locked"
+    await db.execute("PRAGMA busy_timeout=5000")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            subscribed_until INTEGER,
+            last_request_date INTEGER,
+            requests_today INTEGER DEFAULT 0,
+            invoice_id TEXT
         )
-        await db.commit()
+    """)
+    # Миграция старых баз: ISO-строки дат превращаем в числа
+    # (unix-секунды и YYYYMMDD), чтобы сравнивать без парсинга.
+    # Старые строки писались через datetime.now() в локальном времени,
+    # модификатор 'utc' говорит SQLite пересчитать их в epoch корректно
+    await db.execute("""
+        UPDATE users
+        SET subscribed_until = CAST(strftime('%s', substr(subscribed_until, 1, 19), 'utc') AS INTEGER)
+        WHERE typeof(subscribed_until) = 'text'
+    """)
+    await db.execute("""
+        UPDATE users
+        SET last_request_date = CAST(replace(last_request_date, '-', '') AS INTEGER)
+        WHERE typeof(last_request_date) = 'text'
+    """)
+    await db.commit()
 
 
 async def create_cryptocloud_invoice(user_id: int, amount: float) -> dict:
@@ -78,11 +208,6 @@ async def create_cryptocloud_invoice(user_id: int, amount: float) -> dict:
     Returns:
         dict: Ответ API CryptoCloud или словарь с ошибкой
     """
-    headers = {
-        "Authorization": f"Token {CRYPTOCLOUD_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     data = {
         "shop_id": CRYPTOCLOUD_SHOP_ID,
         "amount": str(amount),
@@ -94,25 +219,28 @@ async def create_cryptocloud_invoice(user_id: int, amount: float) -> dict:
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.cryptocloud.plus/v2/invoice/create",
-                headers=headers,
-                json=data
-            ) as resp:
-                response_data = await resp.json()
+        session = SESSION
+        async with session.post(
+            "https://api.cryptocloud.plus/v2/invoice/create",
+            headers=CRYPTOCLOUD_HEADERS,
+            json=data
+        ) as resp:
+            response_data = orjson.loads(await resp.read())
 
-                if resp.status != 200:
-                    error_msg = response_data.get("message", "Unknown error")
-                    logging.error(f"CryptoCloud Error {resp.status}: {error_msg}")
-                    return {"error": f"Payment creation failed: {error_msg}"}
+            if resp.status != 200:
+                error_msg = response_data.get("message", "Unknown error")
+                logging.error(f"CryptoCloud Error {resp.status}: {error_msg}")
+                return {"error": f"Payment creation failed: {error_msg}"}
 
-                if response_data.get("status") != "success":
-                    logging.error(f"CryptoCloud API Error: {response_data}")
-                    return {"error": "Payment creation failed"}
+            if response_data.get("status") != "success":
+                logging.error(f"CryptoCloud API Error: {response_data}")
+                return {"error": "Payment creation failed"}
 
-                return response_data
+            return response_data
 
+    except asyncio.TimeoutError:
+        logging.error("CryptoCloud Timeout")
+        return {"error": "Payment service timeout"}
     except Exception as e:
         logging.error(f"CryptoCloud Connection Error: {str(e)}")
         return {"error": f"Connection error: {str(e)}"}
@@ -128,15 +256,137 @@ async def check_invoice_status(invoice_id: str) -> str:
     Returns:
         str: Статус счета ('paid', 'created' и т.д.) или 'error' при ошибке
     """
-    async with aiohttp.ClientSession() as session:
+    try:
+        session = SESSION
         async with session.get(
             f"https://api.cryptocloud.plus/v2/invoice/info?uuid={invoice_id}",
-            headers={"Authorization": f"Token {CRYPTOCLOUD_API_KEY}"}
+            headers=CRYPTOCLOUD_HEADERS
         ) as resp:
-            data = await resp.json()
+            data = orjson.loads(await resp.read())
             return data.get("result", {}).get("status", "error")
+    except asyncio.TimeoutError:
+        logging.error("CryptoCloud Timeout")
+        return "error"
+
+
+def get_cached_response(prompt: str) -> str | None:
+    """Возвращает закэшированный ответ Mistral на промпт, если он свежий."""
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    entry = RESPONSE_CACHE.get(key)
+    if entry is None:
+        return None
+
+    cached_at, text = entry
+    if time.monotonic() - cached_at > RESPONSE_CACHE_TTL:
+        del RESPONSE_CACHE[key]
+        return None
+
+    RESPONSE_CACHE.move_to_end(key)
+    return text
+
+
+def cache_response(prompt: str, text: str):
+    """Сохраняет ответ Mistral в LRU-кэш, вытесняя самые старые записи."""
+    key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    RESPONSE_CACHE[key] = (time.monotonic(), text)
+    RESPONSE_CACHE.move_to_end(key)
+    while len(RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+        RESPONSE_CACHE.popitem(last=False)
+
+
+@timed("stream_mistral_response")
+async def stream_mistral_response(prompt: str, message: Message) -> str | None:
+    """
+    Стримит ответ Mistral AI, постепенно редактируя сообщение в Telegram.
+
+    Первые токены доходят до пользователя через сотни миллисекунд вместо
+    ожидания всей генерации; сообщение обновляется не чаще раза в 500 мс,
+    чтобы не упереться в лимиты Telegram на редактирование.
+
+    Args:
+        prompt (str): Текст запроса пользователя
+        message (Message): Сообщение, на которое отвечаем
+
+    Returns:
+        str | None: Полный текст ответа или None при ошибке
+        (вызывающий код делает обычный запрос без стриминга)
+    """
+    payload = {
+        **MISTRAL_PAYLOAD_BASE,
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True
+    }
+
+    sent = None
+    sent_text = ""
+    parts = []
+    last_edit = 0.0
+
+    try:
+        session = SESSION
+        async with MISTRAL_LIMITER, session.post(
+            "https://api.mistral.ai/v1/chat/completions",
+            headers=MISTRAL_HEADERS,
+            json=payload,
+            timeout=MISTRAL_TIMEOUT
+        ) as response:
+            if response.status != 200:
+                return None
+
+            # SSE: каждая строка вида "data: {...}", финальная - "data: [DONE]"
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+
+                chunk = line[len(b"data:"):].strip()
+                if chunk == b"[DONE]":
+                    break
+
+                delta = orjson.loads(chunk)["choices"][0]["delta"]
+                content = delta.get("content")
+                if not content:
+                    continue
+                parts.append(content)
+
+                now = time.monotonic()
+                if now - last_edit < 0.5:
+                    continue
+                last_edit = now
+
+                sent_text = "".join(parts)
+                if sent is None:
+                    sent = await message.answer(sent_text)
+                else:
+                    await bot.edit_message_text(
+                        sent_text,
+                        chat_id=sent.chat.id,
+                        message_id=sent.message_id
+                    )
+
+        text = "".join(parts)
+        if not text:
+            return None
+
+        # Досылаем хвост, не пришедший за последние 500 мс
+        if sent is None:
+            await message.answer(text)
+        elif text != sent_text:
+            await bot.edit_message_text(
+                text,
+                chat_id=sent.chat.id,
+                message_id=sent.message_id
+            )
+
+        cache_response(prompt, text)
+        return text
+
+    except Exception as e:
+        logging.error(f"Mistral Stream Error: {e}")
+        return None
 
 
+@timed("get_mistral_response")
 async def get_mistral_response(prompt: str) -> str:
     """
     Получает ответ от Mistral AI на заданный промпт.
@@ -148,92 +398,153 @@ async def get_mistral_response(prompt: str) -> str:
         str: Ответ от модели или сообщение об ошибке
     """
     try:
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-
         payload = {
-            "model": MISTRAL_MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-            "max_tokens": 2000
+            **MISTRAL_PAYLOAD_BASE,
+            "messages": [{"role": "user", "content": prompt}]
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        session = SESSION
+        for attempt in range(MISTRAL_MAX_RETRIES + 1):
+            async with MISTRAL_LIMITER, session.post(
                 "https://api.mistral.ai/v1/chat/completions",
-                headers=headers,
-                json=payload
+                headers=MISTRAL_HEADERS,
+                json=payload,
+                timeout=MISTRAL_TIMEOUT
             ) as response:
                 if response.status == 200:
-                    data = await response.json()
-                    return data["choices"][0]["message"]["content"]
-                elif response.status == 429:
-                    return "⚠ Система перегружена. Пожалуйста, попробуйте позже."
-                else:
+                    data = orjson.loads(await response.read())
+                    content = data["choices"][0]["message"]["content"]
+                    cache_response(prompt, content)
+                    return content
+                elif response.status != 429:
                     error = await response.text()
                     raise Exception(f"Mistral API Error {response.status}: {error}")
 
+            # 429: экспоненциальная пауза с джиттером и повтор
+            if attempt < MISTRAL_MAX_RETRIES:
+                await asyncio.sleep(min(
+                    MISTRAL_BACKOFF_CAP,
+                    MISTRAL_BACKOFF_BASE * 2 ** attempt + random.random()
+                ))
+
+        return "⚠ Система перегружена. Пожалуйста, попробуйте позже."
+
+    except asyncio.TimeoutError:
+        logging.error("Mistral Timeout")
+        return "⚠ Сервис отвечает слишком долго. Пожалуйста, попробуйте позже."
     except Exception as e:
         logging.error(f"Mistral Error: {e}")
         return "⚠ Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже."
 
 
-async def check_access(user_id: int) -> bool:
-    """Проверяет доступ пользователя и обновляет счетчик запросов."""
-    today = datetime.now().strftime("%Y-%m-%d")
+@timed("check_access")
+async def check_access(user_id: int) -> tuple[bool, int]:
+    """
+    Проверяет доступ пользователя и обновляет счетчик запросов.
 
-    async with aiosqlite.connect("users.db") as db:
-        # Получаем текущие данные пользователя
-        cursor = await db.execute(
-            "SELECT subscribed_until, last_request_date, requests_today FROM users WHERE user_id = ?",
-            (user_id,)
-        )
-        user = await cursor.fetchone()
+    Args:
+        user_id (int): ID пользователя Telegram
+
+    Returns:
+        tuple[bool, int]: Разрешен ли запрос и сколько бесплатных
+        запросов осталось сегодня
+    """
+    today = int(datetime.now().strftime("%Y%m%d"))
+
+    entry = COUNTERS.get(user_id)
+    if entry is None:
+        # Промах кэша - читаем из бд один раз
+        async with DB_LOCK:
+            entry = COUNTERS.get(user_id)
+            if entry is None:
+                entry = await _load_counter(user_id)
+
+    last_request_date, requests_today, subscribed_until = entry
+
+    # Быстрый путь для подписчиков: одно числовое сравнение,
+    # без учёта лимитов и без обращений к бд
+    if subscribed_until and time.time() < subscribed_until:
+        return True, MAX_FREE_REQUESTS_PER_DAY
+
+    # Новый день - счетчик начинается заново
+    if last_request_date != today:
+        requests_today = 0
+
+    if requests_today >= MAX_FREE_REQUESTS_PER_DAY:
+        return False, 0
+
+    # Инкремент в памяти; в бд запись уйдет фоновым сбросом
+    entry[0] = today
+    entry[1] = requests_today + 1
+    DIRTY_USERS.add(user_id)
+    return True, max(0, MAX_FREE_REQUESTS_PER_DAY - entry[1])
+
+
+async def _load_counter(user_id: int) -> list:
+    """Загружает счетчик пользователя из бд в кэш при промахе."""
+    db = DB
+    cursor = await db.execute(
+        "SELECT last_request_date, requests_today, subscribed_until FROM users WHERE user_id = ?",
+        (user_id,)
+    )
+    row = await cursor.fetchone()
+    # Даты хранятся числами (YYYYMMDD и unix-секунды),
+    # так что кэшируем строку как есть
+    entry = list(row) if row else [None, 0, None]
+    COUNTERS[user_id] = entry
+    return entry
 
-        if not user:
-            # Новый пользователь - добавляем в базу
-            await db.execute(
-                "INSERT INTO users (user_id, last_request_date, requests_today) VALUES (?, ?, 1)",
-                (user_id, today)
-            )
-            await db.commit()
-            return True
 
-        subscribed_until, last_request_date, requests_today = user
+async def flush_counters():
+    """Фоновая задача: периодически пишет изменённые счетчики в бд."""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await flush_dirty_counters()
+        prune_user_locks()
 
-        # Проверяем подписку
-        if subscribed_until and datetime.now() < datetime.fromisoformat(subscribed_until):
-            return True
 
-        # Проверяем дневной лимит
-        if last_request_date != today:
-            # Новый день - сбрасываем счетчик
-            await db.execute(
-                "UPDATE users SET last_request_date = ?, requests_today = 1 WHERE user_id = ?",
-                (today, user_id)
-            )
-            await db.commit()
-            return True
-        elif requests_today < MAX_FREE_REQUESTS_PER_DAY:
-            # Увеличиваем счетчик запросов
-            await db.execute(
-                "UPDATE users SET requests_today = requests_today + 1 WHERE user_id = ?",
-                (user_id,)
-            )
-            await db.commit()
-            return True
+def prune_user_locks():
+    """Удаляет локи простаивающих пользователей, ограничивая память."""
+    idle = [uid for uid, lock in USER_LOCKS.items() if not lock.locked()]
+    for user_id in idle:
+        del USER_LOCKS[user_id]
+
+
+async def flush_dirty_counters():
+    """Сбрасывает накопленные в памяти изменения счетчиков в бд."""
+    if not DIRTY_USERS:
+        return
 
-        return False
+    dirty = list(DIRTY_USERS)
+    DIRTY_USERS.clear()
+
+    db = DB
+    await db.executemany(
+        """
+        INSERT INTO users (user_id, last_request_date, requests_today)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            last_request_date = excluded.last_request_date,
+            requests_today = excluded.requests_today
+        """,
+        [
+            (uid, COUNTERS[uid][0], COUNTERS[uid][1])
+            for uid in dirty if uid in COUNTERS
+        ]
+    )
+    await db.commit()
 
 
+@timed("get_remaining_requests")
 async def get_remaining_requests(user_id: int) -> int:
     """Возвращает количество оставшихся бесплатных запросов."""
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = int(datetime.now().strftime("%Y%m%d"))
 
-    async with aiosqlite.connect("users.db") as db:
+    entry = COUNTERS.get(user_id)
+    if entry is not None:
+        last_request_date, requests_today = entry[0], entry[1]
+    else:
+        db = DB
         cursor = await db.execute(
             "SELECT last_request_date, requests_today FROM users WHERE user_id = ?",
             (user_id,)
@@ -245,10 +556,10 @@ async def get_remaining_requests(user_id: int) -> int:
 
         last_request_date, requests_today = user
 
-        if last_request_date != today:
-            return MAX_FREE_REQUESTS_PER_DAY
-        else:
-            return max(0, MAX_FREE_REQUESTS_PER_DAY - requests_today)
+    if last_request_date != today:
+        return MAX_FREE_REQUESTS_PER_DAY
+    else:
+        return max(0, MAX_FREE_REQUESTS_PER_DAY - requests_today)
 
 
 async def update_subscription(user_id: int, months: int = 1):
@@ -259,13 +570,27 @@ async def update_subscription(user_id: int, months: int = 1):
         user_id (int): ID пользователя Telegram
         months (int): Количество месяцев подписки (по умолчанию 1)
     """
-    async with aiosqlite.connect("users.db") as db:
-        subscribed_until = datetime.now() + timedelta(days=30*months)
-        await db.execute(
-            "UPDATE users SET subscribed_until = ? WHERE user_id = ?",
-            (subscribed_until.isoformat(), user_id)
-        )
-        await db.commit()
+    db = DB
+    subscribed_until = datetime.now() + timedelta(days=30*months)
+    subscribed_ts = int(subscribed_until.timestamp())
+    # UPSERT, а не UPDATE: строка пользователя могла ещё не доехать
+    # до бд (счетчики пишутся фоновым сбросом раз в 30 секунд),
+    # а подписку терять нельзя
+    await db.execute(
+        """
+        INSERT INTO users (user_id, subscribed_until)
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            subscribed_until = excluded.subscribed_until
+        """,
+        (user_id, subscribed_ts)
+    )
+    await db.commit()
+
+    # Обновляем кэш, чтобы подписка действовала сразу
+    entry = COUNTERS.get(user_id)
+    if entry is not None:
+        entry[2] = subscribed_ts
 
 
 @dp.message(Command("start"))
@@ -281,18 +606,10 @@ async def cmd_start(message: Message):
     if message.from_user is None:
         return
 
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(
-        text="💳 Купить подписку (3 USD)", 
-        callback_data="buy_subscription")
-    )
-
     remaining = await get_remaining_requests(message.from_user.id)
     await message.answer(
-        f"🤖 Привет! Я бот с Mistral AI.\n\n"
-        f"🎁 У вас осталось {remaining} бесплатных запросов сегодня\n"
-        f"🔓 Для неограниченного доступа оформите подписку.",
-        reply_markup=builder.as_markup()
+        START_TEXT.format(remaining=remaining),
+        reply_markup=BUY_MARKUP
     )
 
 
@@ -356,7 +673,7 @@ async def check_payment(callback: types.CallbackQuery):
         return
 
     await callback.answer()
-    invoice_id = callback.data.split('_')[2]
+    invoice_id = callback.data.removeprefix("check_payment_")
     status = await check_invoice_status(invoice_id)
 
     if callback.message is None:
@@ -372,7 +689,34 @@ async def check_payment(callback: types.CallbackQuery):
         await callback.message.answer("⚠ Оплата не найдена. Если вы оплатили, попробуйте позже.")
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    """
+    Показывает администратору накопленную статистику PROF.
+
+    Args:
+        message (Message): Входящее сообщение с командой /stats
+    """
+    if message.from_user is None or message.from_user.id != ADMIN_ID:
+        return
+
+    if not PROF:
+        await message.answer("Статистика пока не накоплена")
+        return
+
+    lines = []
+    for name, (count, total) in sorted(
+        PROF.items(), key=lambda item: item[1][1], reverse=True
+    ):
+        lines.append(
+            f"{name}: {count} выз., "
+            f"{total * 1000 / count:.1f} мс/выз., {total:.2f} с всего"
+        )
+    await message.answer("\n".join(lines))
+
+
 @dp.message(F.text)
+@timed("handle_message")
 async def handle_message(message: Message):
     """
     Обрабатывает текстовые сообщения от пользователей.
@@ -392,23 +736,31 @@ async def handle_message(message: Message):
         await message.answer("⚠ Получено пустое сообщение")
         return
 
-    if not await check_access(message.from_user.id):
-        remaining = await get_remaining_requests(message.from_user.id)
-        time_until_midnight = get_time_until_midnight()
-        await message.answer(
-            f"🚫 Лимит бесплатных запросов исчерпан (10 в день).\n"
-            f"Оформите подписку для неограниченного доступа.\n"
-            f"Новые запросы будут доступны через {time_until_midnight}."
-        )
+    allowed, remaining = await check_access(message.from_user.id)
+    if not allowed:
+        await message.answer(LIMIT_EXCEEDED_TEXT.format(
+            time_until_midnight=get_time_until_midnight()
+        ))
         return
 
     try:
         await bot.send_chat_action(message.chat.id, "typing")
-        response = await get_mistral_response(message.text)
-        await message.answer(response)
 
-        # Обновляем информацию о оставшихся запросах
-        remaining = await get_remaining_requests(message.from_user.id)
+        # Пока не пришел ответ на предыдущий запрос этого пользователя,
+        # следующий к Mistral не уходит
+        async with USER_LOCKS[message.from_user.id]:
+            # Повторный промпт - отвечаем из кэша без похода в Mistral
+            cached = get_cached_response(message.text)
+            if cached is not None:
+                await message.answer(cached)
+            else:
+                response = await stream_mistral_response(message.text, message)
+                if response is None:
+                    # Стрим не удался - обычный запрос с полной буферизацией
+                    response = await get_mistral_response(message.text)
+                    await message.answer(response)
+
+        # Информация об оставшихся запросах уже получена из check_access
         if remaining <= 3:
             await message.answer(f"ℹ У вас осталось {remaining} бесплатных запросов сегодня.")
     except Exception as e:
@@ -416,38 +768,73 @@ async def handle_message(message: Message):
         await message.answer("⚠ Произошла ошибка при обработке запроса")
 
 
+# Кэш строки "до полуночи": при шквале сообщений сверх лимита
+# не пересобираем datetime и строку чаще раза в секунду
+_MIDNIGHT_CACHE: tuple[float, str] = (0.0, "")
+
+
 def get_time_until_midnight():
     """Возвращает строку с временем до полуночи."""
+    global _MIDNIGHT_CACHE
+
+    cached_at, cached_text = _MIDNIGHT_CACHE
+    now_mono = time.monotonic()
+    if cached_text and now_mono - cached_at < 1.0:
+        return cached_text
+
     now = datetime.now()
     midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
     delta = midnight - now
     hours = delta.seconds // 3600
     minutes = (delta.seconds % 3600) // 60
-    return f"{hours} ч. {minutes} мин."
-
-
-async def scheduled_reset():
-    """Ежедневный сброс счетчиков запросов."""
-    while True:
-        now = datetime.now()
-        next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        await asyncio.sleep((next_midnight - now).total_seconds())
-        await reset_daily_limits()
+    text = f"{hours} ч. {minutes} мин."
+    _MIDNIGHT_CACHE = (now_mono, text)
+    return text
 
 
 async def main():
     """Основная функция для запуска бота.
 
     Инициализирует базу данных, удаляет вебхук (если был), запускает фоновую задачу
-    для ежедневного сброса счетчиков запросов и начинает поллинг обновлений.
+    записи счетчиков запросов в бд и начинает поллинг обновлений.
     """
+    global SESSION, DB
+
+    # Одно соединение на весь процесс: aiosqlite не пересоздаёт
+    # рабочий поток и не переоткрывает файл на каждый запрос
+    DB = await aiosqlite.connect("users.db")
+
     await init_db()
     await bot(DeleteWebhook(drop_pending_updates=True))
 
-    # Запускаем фоновую задачу для сброса счетчиков
-    asyncio.create_task(scheduled_reset())
+    # Одна сессия на весь процесс: пул соединений + кэш DNS;
+    # orjson сериализует payload заметно быстрее stdlib json
+    SESSION = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100,
+            ttl_dns_cache=300,
+            keepalive_timeout=75
+        ),
+        # Зависший апстрим не должен вечно держать корутину пользователя
+        timeout=aiohttp.ClientTimeout(total=30, connect=5, sock_read=25),
+        json_serialize=lambda obj: orjson.dumps(obj).decode()
+    )
 
-    await dp.start_polling(bot)
+    try:
+        # Запускаем фоновую задачу записи счетчиков в бд.
+        # Отдельного ночного сброса нет: лимит привязан к дате,
+        # и при смене дня check_access сам начинает счёт с нуля
+        asyncio.create_task(flush_counters())
+
+        await dp.start_polling(bot)
+    finally:
+        # Не теряем накопленные в памяти счетчики при остановке
+        await flush_dirty_counters()
+        await SESSION.close()
+        await DB.close()
 
 if __name__ == "__main__":
+    # uvloop (libuv) заметно снижает накладные расходы цикла событий;
+    # бот полностью I/O-bound, так что выигрыш на каждом сообщении
+    uvloop.install()
     asyncio.run(main())